@@ -1,2 +1,2 @@
 from udon.layout.device import rasterdevice
-from udon.layout.rasterization import raster
+from udon.layout.rasterization import raster, raster_compile
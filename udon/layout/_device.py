@@ -1,5 +1,6 @@
 import phidl
 import jax.numpy as np
+import numpy as onp
 
 
 class RasterDevice(phidl.Device):
@@ -11,14 +12,35 @@ class RasterDevice(phidl.Device):
 
   This helps prevent arbitrary operations (some of which may not be supported)
   one a `RasterDevice`.
+
+  If given, `polygonfn()` is called the first time that the polygons of the
+  device are accessed, and the polygons it returns are added at `spec`.
   """
 
-  def __init__(self, spec, rasterfn, bbox, *args, **kwargs):
+  def __init__(self, spec, rasterfn, bbox, *args, polygonfn=None, **kwargs):
+    self._polygonfn = polygonfn
     super(RasterDevice, self).__init__(*args, **kwargs)
     self._bbox = bbox
     self._rasterfn = rasterfn
     self._spec = spec
 
+  # Overrides the `polygons` attribute of `gdspy.Cell`, through which all
+  # polygon accesses go, so that polygons can be produced lazily.
+  @property
+  def polygons(self):
+    if self._polygonfn is not None:
+      # Only cleared once `polygonfn()` succeeds, so that it is retried if it
+      # raises instead of leaving the device without polygons.
+      polygons = self._polygonfn()
+      self._polygonfn = None
+      for p in polygons:
+        self.add_polygon(p, self._spec)
+    return self._polygons
+
+  @polygons.setter
+  def polygons(self, polygons):
+    self._polygons = polygons
+
   @property
   def bbox(self):
     return self._bbox
@@ -39,3 +61,15 @@ def bounded_raster(rasterfn, x, y, bbox):
       np.logical_and(x >= bbox[0][0], x <= bbox[1][0]),
       np.logical_and(y >= bbox[0][1], y <= bbox[1][1]))
   return np.where(in_bbox, np.clip(rasterfn(x, y), 0., 1.), 0.0)
+
+
+def clip_to_bbox(rvals, x, y, bbox):
+  """Same as `bounded_raster()` but for host-side `numpy` values `rvals`.
+
+  Avoids dispatching these small operations through JAX, which is
+  comparatively expensive.
+  """
+  in_bbox = onp.logical_and(
+      onp.logical_and(x >= bbox[0][0], x <= bbox[1][0]),
+      onp.logical_and(y >= bbox[0][1], y <= bbox[1][1]))
+  return onp.where(in_bbox, onp.clip(rvals, 0., 1.), 0.0)
@@ -1,4 +1,4 @@
-from udon.layout._device import bounded_raster
+from udon.layout._device import clip_to_bbox
 
 import jax
 import numpy as onp
@@ -21,23 +21,20 @@ def deraster(rasterfn, bbox, resolution, threshold=0.5):
   `add_polygon()`.
   """
   # Produce the raster values.
-  xgrid = _gridpoints(bbox[0][0], bbox[1][0], resolution)
-  ygrid = _gridpoints(bbox[0][1], bbox[1][1], resolution)
+  xgrid, dx = _gridpoints(bbox[0][0], bbox[1][0], resolution)
+  ygrid, dy = _gridpoints(bbox[0][1], bbox[1][1], resolution)
   x, y = onp.meshgrid(xgrid, ygrid, indexing='ij')
-  rvals = bounded_raster(rasterfn, x, y, bbox)
 
   # Stop JAX from trying to trace the gradient through `deraster()` since we do
-  # not intend to support differentiation here anyways.
-  rvals = jax.lax.stop_gradient(rvals)
+  # not intend to support differentiation here anyways. This also allows
+  # clipping to `bbox` to be done on the host via `numpy`.
+  rvals = onp.asarray(jax.lax.stop_gradient(rasterfn(x, y)))
+  rvals = clip_to_bbox(rvals, x, y, bbox)
 
-  # Produce de-embedded polygons by first finding contours and adding them to
-  # an empty device via the `XOR` operation.
-  d = phidl.Device()
-  contours = _contour(xgrid, ygrid, onp.array(rvals), threshold)
-  for c in contours:
-    dnext = phidl.Device()
-    dnext.add_polygon(c)
-    d = phidl.geometry.xor_diff(d, dnext)
+  # Produce de-embedded polygons by first finding contours and combining them
+  # via the `XOR` operation.
+  contours = _contour(rvals, threshold, (xgrid[0], ygrid[0]), (dx, dy))
+  d = _xor_reduce([_polygon_device(c) for c in contours])
 
   # Intersect with rectangle that is the bounding box for crisp edges.
   bbox_device = phidl.Device()
@@ -51,18 +48,45 @@ def deraster(rasterfn, bbox, resolution, threshold=0.5):
   return d.get_polygons()
 
 
+def _polygon_device(polygon):
+  """Returns a `phidl.Device` containing only `polygon`."""
+  d = phidl.Device()
+  d.add_polygon(polygon)
+  return d
+
+
+def _xor_reduce(devices):
+  """Combines `devices` via the `XOR` operation.
+
+  Devices are combined pairwise, in a tree, so that each boolean operation
+  only acts on a fraction of the polygons instead of on an ever-growing
+  accumulated device. Note that the operation cannot be done in a single
+  `phidl.geometry.boolean()` call since the polygons of each operand are first
+  unioned together, which would fill in the holes of nested contours.
+  """
+  if not devices:
+    return phidl.Device()
+  if len(devices) == 1:
+    return devices[0]
+  mid = len(devices) // 2
+  return phidl.geometry.xor_diff(_xor_reduce(devices[:mid]),
+                                 _xor_reduce(devices[mid:]))
+
+
 def _gridpoints(x0, x1, resolution):
-  """Gridpoints encompassing `(x0, x1)` with resolution at least `resolution`.
+  """Uniform gridpoints over `(x0, x1)` with resolution at least `resolution`.
   
-  Also adds additional boundary points at both `x0 - dx` and `x1 - dx` where
+  Also adds additional boundary points at both `x0 - dx` and `x1 + dx` where
   `dx` is the effective resolution.
+
+  Returns `(points, dx)`.
   """
   length = x1 - x0
   n = _ceildiv(length, resolution)
   dx = length / n
   return onp.concatenate([onp.array([x0 - dx]),
-                          onp.linspace(x0, x1, n, endpoint=True),
-                          onp.array([x1 + dx])])
+                          onp.linspace(x0, x1, n + 1, endpoint=True),
+                          onp.array([x1 + dx])]), dx
 
 
 def _ceildiv(x, y):
@@ -70,14 +94,16 @@ def _ceildiv(x, y):
   return -int(-x // y)
 
 
-def _contour(x, y, z, threshold):
-  """Similar to `pyplot.contour` but doesn't plot anything."""
-  contours = []
-  for c in find_contours(z, threshold):
-    contours.append(
-        onp.stack([_interp(c[:, 0], x), _interp(c[:, 1], y)], axis=-1))
-  return contours
+def _contour(z, threshold, origin, delta):
+  """Similar to `pyplot.contour` but doesn't plot anything.
 
+  Contours are mapped from indices of `z` to the uniform grid with points at
+  `origin + i * delta`.
+  """
+  contours = find_contours(z, threshold)
+  if not contours:
+    return []
 
-def _interp(x, xref):
-  return onp.interp(x, onp.arange(len(xref)), xref)
+  # Map all the contours at once instead of one at a time.
+  points = onp.asarray(origin) + onp.concatenate(contours) * onp.asarray(delta)
+  return onp.split(points, onp.cumsum([len(c) for c in contours[:-1]]))
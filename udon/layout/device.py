@@ -1,10 +1,15 @@
 from udon.layout._device import RasterDevice
 from udon.layout.derasterization import deraster
 
+import collections
 import phidl
 
+_DERASTER_CACHE_SIZE = 32
+_deraster_cache = collections.OrderedDict()
 
-def rasterdevice(name, spec, rasterfn, bbox, deraster_resolution):
+
+def rasterdevice(name, spec, rasterfn, bbox, deraster_resolution,
+                 cache_key=None, lazy=False):
   """Returns a `RasterDevice` inside a `Device`.
 
   Args:
@@ -13,14 +18,49 @@ def rasterdevice(name, spec, rasterfn, bbox, deraster_resolution):
     rasterfn: `rasterfn(x, y)` returning raster values at `(x, y)`.
     bbox: `((x0, y0), (x1, y1))` bounding box for the `RasterDevice`.
     deraster_resolution: Minimum resolution to use when computing polygons.
+    cache_key: Optional hashable key identifying `rasterfn`, used to reuse
+        previously derastered polygons for the same `(cache_key, bbox,
+        deraster_resolution)`. If `None` (default), polygons are not cached.
+    lazy: If `True`, defers derastering until the polygons of the
+        `RasterDevice` are first accessed, which is skipped entirely if only
+        rasterizing via `raster()`. Must not be used if `rasterfn` depends on
+        values traced by JAX (e.g. under `jax.grad()`) which may no longer be
+        valid by the time the polygons are accessed.
   """
+  def polygonfn():
+    if cache_key is None:
+      return deraster(rasterfn, bbox, deraster_resolution)
+    return _cached_deraster(cache_key, rasterfn, bbox, deraster_resolution)
+
   # Add polygons to the `RasterDevice`.
-  rd = RasterDevice(spec, rasterfn, bbox)
-  polygons = deraster(rasterfn, bbox, deraster_resolution)
-  for p in polygons:
-    rd.add_polygon(p, spec)
+  if lazy:
+    rd = RasterDevice(spec, rasterfn, bbox, polygonfn=polygonfn)
+  else:
+    rd = RasterDevice(spec, rasterfn, bbox)
+    for p in polygonfn():
+      rd.add_polygon(p, spec)
 
   # Wrap the `RasterDevice` as a reference to a `phidl.Device`.
   d = phidl.Device(name)
   d.add_ref(rd)
   return d
+
+
+def _cached_deraster(key, rasterfn, bbox, resolution):
+  """`deraster()` memoized on `(key, bbox, resolution)`.
+
+  Falls back to an uncached `deraster()` if the key is not hashable.
+  """
+  try:
+    key = (key, tuple(tuple(p) for p in bbox), resolution)
+    hash(key)
+  except TypeError:
+    return deraster(rasterfn, bbox, resolution)
+
+  if key in _deraster_cache:
+    _deraster_cache.move_to_end(key)
+  else:
+    _deraster_cache[key] = deraster(rasterfn, bbox, resolution)
+    if len(_deraster_cache) > _DERASTER_CACHE_SIZE:
+      _deraster_cache.popitem(last=False)
+  return _deraster_cache[key]
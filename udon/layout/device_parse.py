@@ -1,5 +1,8 @@
 from udon.layout._device import RasterDevice
 import collections
+import copy
+import functools
+import phidl
 
 _ReferenceTransform = collections.namedtuple(
     "_ReferenceTransform",
@@ -13,6 +16,32 @@ def _reftx(ref):
                              magnification=ref.magnification)
 
 
+def _cached(fn):
+  """Caches `fn(device)` on `device` itself.
+
+  The cached value may refer back to `device`, so it is stored in the
+  `__dict__` of `device` instead of in a separate mapping, which lets the
+  garbage collector free both together. The value is stored along with the
+  `id()` of `device`, so that copies of `device` (which also copy its
+  `__dict__`) do not reuse it.
+
+  Devices are assumed to not be modified once they have been parsed since the
+  cached value is not invalidated.
+  """
+  attr = "_udon_" + fn.__name__
+
+  @functools.wraps(fn)
+  def cached_fn(device):
+    key, value = device.__dict__.get(attr, (None, None))
+    if key != id(device):
+      value = fn(device)
+      device.__dict__[attr] = (id(device), value)
+    return value
+
+  return cached_fn
+
+
+@_cached
 def extract_raster(device):
   """Extracts `RasterDevice` objects with their associated transformations.
 
@@ -28,17 +57,26 @@ def extract_raster(device):
   return z
 
 
+@_cached
 def filter_raster(device):
-  """Returns a copy of `device` with all `RasterDevice` objects removed."""
-  d = device.copy(device.name + "_frcopy", deep_copy=True)
+  """Returns a copy of `device` with all `RasterDevice` objects removed.
 
-  d.references[:] = [r for r in d.references
-                     if not isinstance(r.parent, RasterDevice)]
+  The copy is shallow in that polygons, paths, and labels are shared with
+  `device` instead of being copied.
+  """
+  d = phidl.Device(device.name + "_frcopy")
+  d.polygons = list(device.polygons)
+  d.paths = list(device.paths)
+  d.labels = list(device.labels)
 
-  for ref in d.references:
+  for ref in device.references:
+    if isinstance(ref.parent, RasterDevice):
+      continue
+    ref = copy.copy(ref)
     f = filter_raster(ref.parent)
     # Need to modify both `parent` (used by `phidl`) and `cell` (used by `gdspy`).
     ref.parent = f
     ref.ref_cell = f
+    d.references.append(ref)
 
   return d
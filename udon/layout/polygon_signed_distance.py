@@ -1,43 +1,105 @@
+import jax
 import jax.numpy as np
 
+# Maximum number of polygon edges that are processed at once.
+_EDGE_BLOCK_SIZE = 64
 
+
+@jax.jit
 def polygon_sdf(polygon, x, y):
-  """Signed distance of `polygon` for `points`.
+  """Signed distance of `polygon` at points `(x, y)`.
 
   Implementation of the algorithm described in 
   https://iquilezles.org/www/articles/distfunctions2d/distfunctions2d.htm
-  (under polygon), and https://www.shadertoy.com/view/wdBXRW, which computes
-  "windings" to determine whether a point is inside a polygon.
+  (under polygon), and https://www.shadertoy.com/view/wdBXRW, except that
+  the "windings" are summed into a winding number instead of being tracked via
+  their parity to determine whether a point is inside a polygon.
  
   Args:
     polygon: is a `N x 2` array with of `(x, y)` pairs specifying the points
         that make up the polygon. The first and last points should not be
-        equal as the connectivity of the polygon is assumed.
+        equal as the connectivity of the polygon is assumed. Repeated
+        consecutive points are allowed.
     x, y: arrays of points for which signed distances are to
         be computed, using the convention that negative/positive distances
-        correspond to  interior/exterior of the polygon respectively.
+        correspond to  interior/exterior of the polygon respectively. The
+        two are broadcast against each other.
+
+  Returns signed distances as an array of the broadcasted shape of `x` and `y`.
+  """
+  # The `i`-th edge runs from `(px[i], py[i])` to `(qx[i], qy[i])`, that is
+  # from `polygon[i]` to `polygon[i-1]`. Computations are done in the
+  # precision of the points (`float32` by default), instead of letting a
+  # `float64` polygon promote all of them.
+  polygon = polygon.astype(np.result_type(x, y, np.float32))
+  px, py = polygon[:, 0], polygon[:, 1]
+  qx, qy = np.roll(px, 1), np.roll(py, 1)
+
+  n = polygon.shape[0]
+  if n <= _EDGE_BLOCK_SIZE:
+    winding, dist2 = _edge_sdf(x, y, px, py, qx, qy)
+  else:
+    # For large polygons, loop over blocks of edges so that the size of both
+    # the compiled graph and the intermediate arrays stays bounded. Blocks are
+    # padded with degenerate edges at `polygon[0]`, which have no effect.
+    num_blocks = -(-n // _EDGE_BLOCK_SIZE)
+    pad = num_blocks * _EDGE_BLOCK_SIZE - n
+    blocks = tuple(
+        np.pad(v, (0, pad), constant_values=v0).reshape(num_blocks, -1)
+        for v, v0 in ((px, px[0]), (py, py[0]), (qx, px[0]), (qy, py[0])))
+
+    def body(carry, edges):
+      winding, dist2 = _edge_sdf(x, y, *edges)
+      return (carry[0] + winding, np.minimum(carry[1], dist2)), None
+
+    shape = np.broadcast_shapes(np.shape(x), np.shape(y))
+    init = (np.zeros(shape, int), np.full(shape, np.inf, polygon.dtype))
+    (winding, dist2), _ = jax.lax.scan(body, init, blocks)
+
+  dist = np.sqrt(dist2)
+  return np.where(winding != 0, -dist, dist)
+
 
-  Returns signed distances as an array of shape equal to `x`.
+def padded_length(n):
+  """Length to pad a polygon of `n` points to when batching polygons.
+
+  Rounds up to a power of two for small polygons, and to a multiple of the
+  number of edges processed at once by `polygon_sdf()` for large ones.
+  """
+  if n <= _EDGE_BLOCK_SIZE:
+    return 1 << (n - 1).bit_length()
+  else:
+    return -(-n // _EDGE_BLOCK_SIZE) * _EDGE_BLOCK_SIZE
+
+
+def _edge_sdf(x, y, px, py, qx, qy):
+  """Winding number and squared distance for the edges from `p` to `q`.
+
+  Vectorized over all edges at once, with the `x` and `y` components kept
+  separate, so that intermediate arrays have shape `x.shape + (N,)`.
   """
-  points = np.stack([x, y], axis=-1)
-  dist = np.linalg.norm(polygon[0] - points, axis=-1)
-  sign = np.ones(points.shape[0:-1], points.dtype)
-
-  for i in range(polygon.shape[0]):
-    edge = polygon[i-1] - polygon[i]
-    vect = points - polygon[i]
-
-    # Update `sign`.
-    wind = np.stack([points[..., 1] >= polygon[i, 1],
-                     points[..., 1] < polygon[i-1, 1],
-                     edge[0] * vect[..., 1] > edge[1] * vect[..., 0]], axis=-1)
-    sign = np.where(
-        np.all(wind, axis=-1) | np.all(np.logical_not(wind), axis=-1),
-        -sign, sign)
-
-    # Update `dist`.
-    ratio = np.clip(np.dot(vect, edge) / np.dot(edge, edge), 0.0, 1.0)
-    vect = vect - edge * np.expand_dims(ratio, axis=-1)
-    dist = np.minimum(dist, np.linalg.norm(vect, axis=-1))
-
-  return sign * dist
+  x, y = np.expand_dims(x, axis=-1), np.expand_dims(y, axis=-1)
+  ex, ey = qx - px, qy - py
+  vx, vy = x - px, y - py
+
+  # The inside/outside test uses the winding number of the edges around each
+  # point, computed as the sum of upward (`+1`) and downward (`-1`) crossings
+  # of the edges. Being integer-valued, it does not enter into gradients.
+  above = y >= py
+  below = y < qy
+  left = ex * vy > ey * vx
+  winding = (np.sum(above & below & left, axis=-1) -
+             np.sum(~above & ~below & ~left, axis=-1))
+
+  # Distances are to the closest point on each edge, where degenerate
+  # (zero-length) edges simply reduce to the distance to their vertex.
+  edge_len2 = ex * ex + ey * ey
+  ratio = np.where(edge_len2 > 0,
+                   (vx * ex + vy * ey) /
+                   np.where(edge_len2 > 0, edge_len2, 1.0), 0.0)
+  ratio = np.clip(ratio, 0.0, 1.0)
+  vx, vy = vx - ex * ratio, vy - ey * ratio
+
+  # Only the closest edge needs an exact distance, so compare squared
+  # distances and leave the square root to the caller.
+  return winding, np.min(vx * vx + vy * vy, axis=-1)
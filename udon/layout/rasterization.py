@@ -1,7 +1,11 @@
-from udon.layout.polygon_signed_distance import polygon_sdf
+from udon.layout.polygon_signed_distance import padded_length, polygon_sdf
 from udon.layout.device_parse import filter_raster, extract_raster
 
+import collections
+import functools
+import jax
 import jax.numpy as np
+import numpy as onp
 
 
 def raster(device, spec, x, y):
@@ -15,42 +19,136 @@ def raster(device, spec, x, y):
 
   Returns:
     `jax.DeviceArray` of raster values of the same shape as `x`.
+
+  Note that the parsed structure of `device` is cached, so that `device` should
+  not be modified after it has been rasterized.
+  """
+  return _rasterfn(device, spec)(x, y)
+
+
+def raster_compile(device, spec):
+  """Returns a compiled `rasterfn(x, y)` of `device` components at `spec`.
+
+  `rasterfn(x, y)` is equivalent to `raster(device, spec, x, y)`, except that
+  `device` is only parsed once, here, and the rasterization itself is compiled
+  via `jax.jit()` (once for every distinct shape of `x` and `y`). As such,
+  changes to `device` made after calling `raster_compile()` are not reflected
+  in `rasterfn`.
+
+  Args:
+    device: `phidl.Device` in which `RasterDevice` objects may be incorporated.
+    spec: `(layer, datatype)` of components to be included in the rasterization.
+
+  Returns:
+    `rasterfn(x, y)` returning raster values at points `(x, y)`. Additionally,
+    `rasterfn.specialize(x_shape, y_shape)` can be used to compile `rasterfn`
+    ahead-of-time for a fixed shape of points.
   """
-  x, y = np.broadcast_arrays(x, y)
-  poly_rvals = _polygon_raster(filter_raster(device), spec, x, y)
-  rdev_rvals = _device_raster(device, spec, x, y)
-  return np.max(np.stack([poly_rvals, rdev_rvals]), axis=0)
+  return _CompiledRaster(_rasterfn(device, spec))
+
+
+class _CompiledRaster(object):
+  """Jitted `rasterfn(x, y)` as returned by `raster_compile()`."""
+
+  def __init__(self, rasterfn):
+    self._rasterfn = jax.jit(rasterfn)
+
+  def __call__(self, x, y):
+    return self._rasterfn(x, y)
+
+  def specialize(self, x_shape, y_shape=None, dtype=np.float32):
+    """Returns `rasterfn` compiled ahead-of-time for `x` and `y` points.
+
+    The returned `jax.stages.Compiled` object only accepts `x` and `y` of shapes
+    `x_shape` and `y_shape` (defaults to `x_shape`) respectively, both of type
+    `dtype`, and skips all tracing and compilation when called. Not supported
+    if the raster functions of `device` depend on values traced by JAX.
+    """
+    y_shape = x_shape if y_shape is None else y_shape
+    return self._rasterfn.lower(jax.ShapeDtypeStruct(x_shape, dtype),
+                                jax.ShapeDtypeStruct(y_shape, dtype)).compile()
+
 
+def _rasterfn(device, spec):
+  """Parses `device` into `rasterfn(x, y)` for components at `spec`."""
+  polygons = _batch_polygons(filter_raster(device).get_polygons(by_spec=spec))
+  rdevices = [(d, _compose_affine(txs))
+              for d, txs in extract_raster(device) if spec == d.spec]
 
-def _polygon_raster(device, spec, x, y):
-  """Raster values for polygons."""
-  polygons = device.get_polygons(by_spec=spec)
+  def rasterfn(x, y):
+    # Broadcast once, for all polygons and `RasterDevice` objects.
+    x, y = np.broadcast_arrays(x, y)
+    poly_rvals = _polygon_raster(polygons, x, y)
+    rdev_rvals = _device_raster(rdevices, x, y)
+    return np.maximum(poly_rvals, rdev_rvals)
+
+  return rasterfn
+
+
+def _polygon_raster(polygons, x, y):
+  """Raster values for batches of `polygons`."""
   if polygons:
-    rvals = np.stack([polygon_sdf(p, x, y) <= 0.0 for p in polygons])
-    return np.any(rvals, axis=0)
+    return _inside_polygons(polygons, x, y)
   else:
     return np.zeros_like(x)
 
 
-def _device_raster(device, spec, x, y):
-  """Raster values for `RasterDevice` objects."""
-  rvals = [_transformed_raster(d, txs, x, y)
-           for d, txs in extract_raster(device) if spec == d.spec]
+@jax.jit
+def _inside_polygons(polygons, x, y):
+  """Whether `(x, y)` is inside of any of the batches of `polygons`."""
+  return functools.reduce(
+      np.logical_or,
+      [np.any(_batched_polygon_sdf(p, x, y) <= 0.0, axis=0) for p in polygons])
+
+
+# Signed distances for a `P x N x 2` array of `P` polygons.
+_batched_polygon_sdf = jax.vmap(polygon_sdf, in_axes=(0, None, None))
+
+
+def _batch_polygons(polygons):
+  """Stacks `polygons` into batches of polygons with the same padded length.
+
+  Polygons are padded with repeats of their last point, which lets polygons of
+  similar lengths share a batch without wasting much work on the padding.
+  """
+  batches = collections.defaultdict(list)
+  for p in polygons:
+    n = padded_length(len(p))
+    batches[n].append(onp.pad(p, ((0, n - len(p)), (0, 0)), mode='edge'))
+  return tuple(onp.stack(batches[n]) for n in sorted(batches))
+
+
+def _device_raster(rdevices, x, y):
+  """Raster values for `(RasterDevice, affine)` pairs in `rdevices`."""
+  rvals = [_transformed_raster(d, affine, x, y) for d, affine in rdevices]
   if rvals:
-    return np.max(np.stack(rvals), axis=0)
+    return functools.reduce(np.maximum, rvals)
   else:
     return np.zeros_like(x)
 
 
-def _transformed_raster(rdevice, transforms, x, y):
-  """Apply `transforms` to `(x, y)` points and rasters the `RasterDevice`."""
+def _transformed_raster(rdevice, affine, x, y):
+  """Apply `affine` to `(x, y)` points and rasters the `RasterDevice`."""
+  a, b = affine
+  return rdevice.raster(a[0, 0] * x + a[0, 1] * y + b[0],
+                        a[1, 0] * x + a[1, 1] * y + b[1])
+
+
+def _compose_affine(transforms):
+  """Composes `transforms` into a single affine map `(a, b)`.
+
+  Applying `transforms` to points `p` in order is equivalent to `a @ p + b`,
+  which allows for the points to be transformed in a single pass.
+  """
+  a, b = onp.eye(2), onp.zeros(2)
   for t in transforms:
-    x, y = _spatial_transform(t, x, y)
-  return rdevice.raster(x, y)
+    ta, tb = _spatial_transform(t)
+    a, b = ta @ a, ta @ b + tb
+  return a, b
 
 
-def _spatial_transform(transform, x, y):
-  """Transform points `(x, y)` according to the `transform`.
+def _spatial_transform(transform):
+  """Affine map `(a, b)` which transforms points according to `transform`.
 
   Can be thought of as the dual to the transformations applied to polygons as
   performed in `CellReference._transform_polygons()` in the `gdspy` package,
@@ -60,22 +158,17 @@ def _spatial_transform(transform, x, y):
 
   Args:
     transform: `_ReferenceTransform` object.
-    x, y: Arrays denoting the points to transform.
-  
-  Returns transformed `(x, y)` points.
-  """
-  x = x - transform.origin[0]
-  y = y - transform.origin[1]
 
-  theta = -transform.rotation * np.pi/180
-  x, y = (x * np.cos(theta) - y * np.sin(theta),
-          y * np.cos(theta) + x * np.sin(theta))
+  Returns `(a, b)` such that points `p` are transformed to `a @ p + b`.
+  """
+  theta = -transform.rotation * onp.pi/180
+  a = onp.array([[onp.cos(theta), -onp.sin(theta)],
+                 [onp.sin(theta), onp.cos(theta)]])
 
   if transform.magnification is not None:
-    x = x / transform.magnification
-    y = y / transform.magnification
+    a = a / transform.magnification
 
   if transform.x_reflection:
-     y = -y
+    a = onp.diag([1., -1.]) @ a
 
-  return x, y
+  return a, -a @ onp.asarray(transform.origin, dtype=float)
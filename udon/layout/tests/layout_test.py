@@ -1,9 +1,14 @@
 import udon.layout as layout
+from udon.layout.polygon_signed_distance import polygon_sdf
 
+import copy
+import gc
 import jax
 import jax.numpy as np
+import numpy as onp
 import phidl
 import unittest
+import weakref
 
 
 def _make_phidl(rasterfn, raster_spec=(0, 0)):
@@ -67,11 +72,77 @@ def _diag_sine(offset):
 
 
 class TestLayout(unittest.TestCase):
+  def test_polygon_sdf(self):
+    """Tests signed distances for small and large (blocked) polygons."""
+    x, y = np.ogrid[-2:2:0.05, -2:2:0.05]
+    for n in (50, 500):
+      theta = np.linspace(0, 2 * np.pi, n, endpoint=False)
+      circle = np.stack([np.cos(theta), np.sin(theta)], axis=-1)
+      err = polygon_sdf(circle, x, y) - (np.sqrt(x**2 + y**2) - 1)
+      self.assertLess(np.max(np.abs(err)), 5e-3)
+
   def test_deraster_quickplot(self):
     """Tests that we can plot derastered polygons."""
     phidl.quickplotter.quickplot(
         _make_phidl(_diag_sine(1), raster_spec=(0, 0)))
 
+  def test_deraster_cache(self):
+    """Tests that derastered polygons are only reused for a `cache_key`."""
+    calls = []
+    def rasterfn(x, y):
+      calls.append(None)
+      return _diag_sine(1)(x, y)
+
+    bbox = ((0, 0), (5, 1))
+    layout.rasterdevice("rasta", (0, 0), rasterfn, bbox, 0.1)
+    layout.rasterdevice("rasta", (0, 0), rasterfn, bbox, 0.1)
+    self.assertEqual(len(calls), 2)
+
+    key = object()
+    d1 = layout.rasterdevice("rasta1", (0, 0), rasterfn, bbox, 0.1,
+                             cache_key=key)
+    d2 = layout.rasterdevice("rasta2", (0, 0), rasterfn, bbox, 0.1,
+                             cache_key=key)
+    self.assertEqual(len(calls), 3)
+    self.assertAlmostEqual(d1.area(), d2.area())
+
+  def test_deraster_lazy(self):
+    """Tests that derastering is deferred until polygons are accessed."""
+    calls = []
+    def rasterfn(x, y):
+      calls.append(None)
+      return _diag_sine(1)(x, y)
+
+    d = layout.rasterdevice("rasta", (0, 0), rasterfn, ((0, 0), (5, 1)), 0.1,
+                            lazy=True)
+    self.assertEqual(len(calls), 0)
+
+    # Rastering only evaluates `rasterfn` at the points.
+    x, y = np.ogrid[-1:6:0.1, -1:2:0.1]
+    layout.raster(d, (0, 0), x, y)
+    self.assertEqual(len(calls), 1)
+
+    self.assertAlmostEqual(
+        d.area(),
+        layout.rasterdevice("rasta", (0, 0), _diag_sine(1), ((0, 0), (5, 1)),
+                            0.1).area())
+    self.assertEqual(len(calls), 2)
+
+    # Derastering is retried if `rasterfn` raises.
+    calls = []
+    def failing_rasterfn(x, y):
+      calls.append(None)
+      if len(calls) == 1:
+        raise ValueError()
+      return _diag_sine(1)(x, y)
+
+    e = layout.rasterdevice("rasta", (0, 0), failing_rasterfn,
+                            ((0, 0), (5, 1)), 0.1, lazy=True)
+    with self.assertRaises(ValueError):
+      e.area()
+    self.assertAlmostEqual(e.area(), d.area())
+    self.assertEqual(len(calls), 2)
+
   def test_raster(self):
     """Tests that rastering works."""
     d = _make_phidl(_diag_sine(1), raster_spec=(0, 0))
@@ -96,6 +167,62 @@ class TestLayout(unittest.TestCase):
     x, y = np.ogrid[-5:15:0.1, -5:15:0.1]
     self.assertAlmostEqual(np.sum(layout.raster(d, (0, 1), x, y)), 498.11148)
 
+  def test_raster_compile(self):
+    """Tests that compiled rastering matches `raster()`."""
+    d = _make_phidl(_diag_sine(1), raster_spec=(0, 0))
+    x, y = np.ogrid[-5:15:0.1, -5:15:0.1]
+    rasterfn = layout.raster_compile(d, (0, 0))
+    onp.testing.assert_allclose(rasterfn(x, y),
+                                layout.raster(d, (0, 0), x, y), atol=1e-5)
+
+  def test_raster_compile_specialize(self):
+    """Tests that ahead-of-time compiled rastering matches `raster()`."""
+    d = _make_phidl(_diag_sine(1), raster_spec=(0, 0))
+    x, y = np.ogrid[-5:15:0.1, -5:15:0.1]
+    rasterfn = layout.raster_compile(d, (0, 0)).specialize(x.shape, y.shape)
+    onp.testing.assert_allclose(rasterfn(x, y),
+                                layout.raster(d, (0, 0), x, y), atol=1e-5)
+
+  def test_raster_compile_constant_rasterfn(self):
+    """Tests compiled rastering of a `rasterfn` ignoring its inputs."""
+    d = phidl.Device()
+    d.add_ref(layout.rasterdevice("const", (0, 0), lambda x, y: 1.0,
+                                  ((0, 0), (1, 1)), 0.1))
+    x, y = np.ogrid[-1:2:0.1, -1:2:0.1]
+    onp.testing.assert_allclose(layout.raster_compile(d, (0, 0))(x, y),
+                                layout.raster(d, (0, 0), x, y))
+
+  def test_raster_frees_device(self):
+    """Tests that rastered devices are not kept alive after a gradient step."""
+    refs = []
+    def loss(offset):
+      x, y = np.ogrid[-5:15:0.1, -5:15:0.1]
+      d = _make_phidl(_diag_sine(offset))
+      refs.append(weakref.ref(d))
+      return np.sum(layout.raster(d, (0, 0), x, y))
+
+    jax.grad(loss)(1.0)
+    gc.collect()
+    self.assertIsNone(refs[0]())
+
+  def test_raster_deepcopy(self):
+    """Tests that a modified copy of a rastered device is rastered anew."""
+    squares = [[(0, 0), (1, 0), (1, 1), (0, 1)],
+               [(2, 0), (3, 0), (3, 1), (2, 1)]]
+    d = phidl.Device()
+    d.add_polygon(squares[0])
+    x, y = np.ogrid[-1:4:0.1, -1:2:0.1]
+    r = layout.raster(d, (0, 0), x, y)
+
+    c = copy.deepcopy(d)
+    c.add_polygon(squares[1])
+    e = phidl.Device()
+    for s in squares:
+      e.add_polygon(s)
+    onp.testing.assert_array_equal(layout.raster(c, (0, 0), x, y),
+                                   layout.raster(e, (0, 0), x, y))
+    onp.testing.assert_array_equal(layout.raster(d, (0, 0), x, y), r)
+
   def test_gradient(self):
     def loss(offset):
       x, y = np.ogrid[-5:15:0.1, -5:15:0.1]
@@ -105,6 +232,19 @@ class TestLayout(unittest.TestCase):
     loss_grad = jax.grad(loss)
     self.assertAlmostEqual(loss_grad(1.0), 500.5)
 
+  def test_gradient_compile(self):
+    """Tests that compiled rastering is differentiable."""
+    def loss(offset, compiled):
+      x, y = np.ogrid[-5:15:0.1, -5:15:0.1]
+      d = _make_phidl(_diag_sine(offset))
+      if compiled:
+        return np.sum(layout.raster_compile(d, (0, 0))(x, y))
+      return np.sum(layout.raster(d, (0, 0), x, y))
+
+    loss_grad = jax.grad(loss)
+    self.assertAlmostEqual(loss_grad(1.0, True), loss_grad(1.0, False),
+                           places=2)
+
 
 if __name__ == '__main__':
   unittest.main()